@@ -0,0 +1,2 @@
+# קובץ זה בתיקיית השורש גורם ל-pytest להוסיף אותה ל-sys.path, כך ש-mizon_app2 ניתן לייבוא מהבדיקות
+# גם בהרצה של pytest רגיל (ולא רק python -m pytest)
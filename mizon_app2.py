@@ -1,8 +1,28 @@
+import os
+import calendar
+import sqlite3
+from contextlib import closing
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 import pandas as pd
-import xml.etree.ElementTree as ET
+import numpy as np
+import io
+import json
+from dataclasses import asdict, dataclass
+try:
+    from lxml import etree as ET # מנתח XML מהיר יותר, אם מותקן
+    # lxml יודע לסנן את אירועי iterparse לפי תגית כבר ברמת ה-C
+    _ITERPARSE_OPTIONS = {"tag": "DateMonth"}
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _ITERPARSE_OPTIONS = {}
+try:
+    import redis # מטמון משותף בין מופעים, אופציונלי
+except ImportError:
+    redis = None
 # ... שאר הייבואים והקוד שלך ...
 
 # Google Analytics Measurement ID
@@ -14,6 +34,20 @@ DATA_GOV_IL_API_URL = "https://api.cbs.gov.il/index/data/price"
 CPI_RESOURCE_ID = "120010"
 # מקדם קשר שנתי (מספר קבוע, לא אחוז)
 ANNUAL_LINKAGE_FACTOR = 1.074
+# מועד החלת מקדם הקשר בכל שנה (חודש, יום)
+LINKAGE_ANCHOR_MONTH, LINKAGE_ANCHOR_DAY = 2, 28
+
+HEBREW_MONTHS = {1: 'ינואר', 2: 'פברואר', 3: 'מרץ', 4: 'אפריל', 5: 'מאי', 6: 'יוני',
+                 7: 'יולי', 8: 'אוגוסט', 9: 'ספטמבר', 10: 'אוקטובר', 11: 'נובמבר', 12: 'דצמבר'}
+
+# מטמון מדדים קבוע על הדיסק (שורד הפעלה מחדש של האפליקציה)
+CPI_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "mizonot_cpi.sqlite")
+CPI_CACHE_TTL = timedelta(hours=12)
+# מדד של חודש שחלפו ממנו יותר מחודשיים כבר פורסם ואינו משתנה
+SETTLED_CPI_AGE_MONTHS = 2
+
+# מטמון Redis משותף לכל מופעי האפליקציה, אם הוגדר REDIS_URL (אחרת משמש המטמון המקומי על הדיסק)
+REDIS_URL = os.environ.get("REDIS_URL")
 
 # Set Streamlit page configuration as the very first Streamlit command
 st.set_page_config(
@@ -42,65 +76,336 @@ href="https://statcounter.com/p13136992/?guest=1">calc-mezonot-madad-analytics</
     unsafe_allow_html=True
 )
 
+# --- רשומת מדד בודדת, כפי שהיא נשמרת במטמון ---
+@dataclass(frozen=True)
+class CpiEntry:
+    value: float
+    base_desc: str
+    month_desc: str
+
+
 # --- פונקציות עזר לטיפול בתאריכים ---
 def get_date_for_cpi_lookup(year, month):
-    return f"{year:04d}{month:02d}"
+    # פורמט התקופה של startPeriod/endPeriod ב-API של הלמ"ס: mm-yyyy
+    return f"{month:02d}-{year:04d}"
+
+def shift_month(year, month, months):
+    """
+    מחזירה (שנה, חודש) לאחר הזזה במספר חודשים נתון (גם שלילי), בחשבון שלמים בלבד.
+    """
+    year_offset, month_index = divmod(month - 1 + months, 12)
+    return year + year_offset, month_index + 1
+
+# --- משאבים משותפים (נוצרים פעם אחת לתהליך, ולא בכל הרצה חוזרת של הדף) ---
+@st.cache_resource(show_spinner=False)
+def _get_http_session():
+    """
+    סשן HTTP משותף: שימוש חוזר בחיבור TLS אחד לכל רצף השליפות מהלמ"ס.
+    """
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]),
+        ),
+    )
+    session.headers["Accept"] = "application/json"
+    return session
+
+
+@st.cache_resource(show_spinner=False)
+def _get_redis_client():
+    """
+    מחזירה לקוח Redis לפי REDIS_URL, או None אם לא הוגדר, אם redis אינו מותקן או אם הכתובת אינה תקינה.
+    """
+    if redis is None or not REDIS_URL:
+        return None
+    try:
+        return redis.Redis.from_url(REDIS_URL, socket_timeout=2)
+    except (ValueError, redis.RedisError):
+        return None # REDIS_URL שגוי - משתמשים במטמון המקומי על הדיסק
+
+
+# --- מטמון מדדים קבוע (Redis משותף או SQLite מקומי) ---
+def _settled_cpi_ordinal(now):
+    # חודשים שהמספר הסידורי שלהם (שנה * 12 + חודש) קטן מזה כבר פורסמו סופית
+    return now.year * 12 + now.month - SETTLED_CPI_AGE_MONTHS
+
+
+def _open_cpi_cache():
+    os.makedirs(os.path.dirname(CPI_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(CPI_CACHE_PATH, timeout=5)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cpi ("
+        "year INTEGER, month INTEGER, value REAL, base_desc TEXT, month_desc TEXT, fetched_at TIMESTAMP, "
+        "PRIMARY KEY (year, month))"
+    )
+    return conn
+
+
+def _read_sqlite_cpi(start_year, start_month, end_year, end_month):
+    """
+    מחזירה את המדדים השמורים על הדיסק בטווח החודשים המבוקש, כמילון {(שנה, חודש): CpiEntry}.
+    מדד של חודש ישן מוחזר תמיד; מדד של החודשים האחרונים מוחזר רק בתוך זמן התפוגה.
+    """
+    try:
+        with closing(_open_cpi_cache()) as conn:
+            rows = conn.execute(
+                "SELECT year, month, value, base_desc, month_desc, fetched_at FROM cpi "
+                "WHERE year * 12 + month BETWEEN ? AND ?",
+                (start_year * 12 + start_month, end_year * 12 + end_month),
+            ).fetchall()
+    except (sqlite3.Error, OSError):
+        return {}
+
+    now = datetime.now()
+    settled_before = _settled_cpi_ordinal(now)
+    cpi_values = {}
+    for year, month, value, base_desc, month_desc, fetched_at in rows:
+        if year * 12 + month < settled_before or now - datetime.fromisoformat(fetched_at) < CPI_CACHE_TTL:
+            cpi_values[(year, month)] = CpiEntry(value, base_desc, month_desc)
+    return cpi_values
+
+
+def _store_sqlite_cpi(cpi_values):
+    fetched_at = datetime.now().isoformat()
+    try:
+        with closing(_open_cpi_cache()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO cpi VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (year, month, entry.value, entry.base_desc, entry.month_desc, fetched_at)
+                    for (year, month), entry in cpi_values.items()
+                ],
+            )
+    except (sqlite3.Error, OSError):
+        pass # The on-disk cache is best-effort only
+
+
+def _redis_cpi_key(year, month):
+    return f"cpi:{year:04d}{month:02d}"
+
+
+def _read_redis_cpi(redis_client, start_year, start_month, end_year, end_month):
+    months = [
+        shift_month(start_year, start_month, offset)
+        for offset in range((end_year * 12 + end_month) - (start_year * 12 + start_month) + 1)
+    ]
+    raw_entries = redis_client.mget([_redis_cpi_key(year, month) for year, month in months])
+    return {
+        key: CpiEntry(**json.loads(raw_entry))
+        for key, raw_entry in zip(months, raw_entries)
+        if raw_entry is not None
+    }
+
+
+def _store_redis_cpi(redis_client, cpi_values):
+    # מדד של חודש ישן נשמר ללא תפוגה; מדד של החודשים האחרונים פג אחרי CPI_CACHE_TTL
+    settled_before = _settled_cpi_ordinal(datetime.now())
+    with redis_client.pipeline() as pipe:
+        for (year, month), entry in cpi_values.items():
+            payload = json.dumps(asdict(entry), ensure_ascii=False)
+            if year * 12 + month < settled_before:
+                pipe.set(_redis_cpi_key(year, month), payload)
+            else:
+                pipe.setex(_redis_cpi_key(year, month), CPI_CACHE_TTL, payload)
+        pipe.execute()
+
+
+def _read_persistent_cpi(start_year, start_month, end_year, end_month):
+    redis_client = _get_redis_client()
+    if redis_client is not None:
+        try:
+            return _read_redis_cpi(redis_client, start_year, start_month, end_year, end_month)
+        except (redis.RedisError, ValueError, TypeError):
+            pass # Redis unreachable or holding bad data - fall back to the local cache
+    return _read_sqlite_cpi(start_year, start_month, end_year, end_month)
+
+
+def _store_persistent_cpi(cpi_values):
+    if not cpi_values:
+        return
+    redis_client = _get_redis_client()
+    if redis_client is not None:
+        try:
+            _store_redis_cpi(redis_client, cpi_values)
+            return
+        except redis.RedisError:
+            pass
+    _store_sqlite_cpi(cpi_values)
+
+
+# --- פונקציות לניתוח תגובת ה-API של הלמ"ס ---
+def _parse_cpi_json(payload):
+    """
+    אוספת מתגובת ה-JSON את כל רשומות החודשים, כמילון {(שנה, חודש): CpiEntry}.
+    """
+    cpi_values = {}
+    for series in payload.get("month", []):
+        for date_entry in series.get("date", []):
+            year = int(date_entry.get("year", 0))
+            month = int(date_entry.get("month", 0))
+
+            curr_base = date_entry.get("currBase") or {}
+            cpi_value = curr_base.get("value")
+            base_desc = curr_base.get("baseDesc")
+            month_desc = date_entry.get("monthDesc") or f"{month:02d}"
+
+            if cpi_value is not None and base_desc:
+                cpi_values[(year, month)] = CpiEntry(float(cpi_value), base_desc, month_desc)
+
+    return cpi_values
+
+
+def _parse_cpi_xml(xml_bytes):
+    """
+    ניתוח חלופי של תגובה בפורמט XML, למקרה שה-API לא החזיר JSON תקין.
+    הסריקה מתבצעת בזרימה (iterparse), וכל רשומת DateMonth משוחררת מיד לאחר קריאתה.
+    """
+    cpi_values = {}
+    for _, elem in ET.iterparse(io.BytesIO(xml_bytes), events=("end",), **_ITERPARSE_OPTIONS):
+        if elem.tag != 'DateMonth':
+            continue
+
+        y_text = elem.findtext('year')
+        m_text = elem.findtext('month')
+        curr_base = elem.find('currBase')
+
+        if y_text and m_text and curr_base is not None:
+            year, month = int(y_text), int(m_text)
+            value_text = curr_base.findtext('value')
+            base_desc = curr_base.findtext('baseDesc')
+            month_desc = elem.findtext('monthDesc') or f"{month:02d}" # Added for display
+
+            if value_text and base_desc:
+                cpi_values[(year, month)] = CpiEntry(float(value_text), base_desc, month_desc)
+
+        elem.clear()
+
+    return cpi_values
+
 
 # --- פונקציה לשליפת מדד המחירים לצרכן מהלמ"ס ---
-@st.cache_data(ttl=timedelta(hours=12))
-def get_cpi_value_and_base(year, month):
+@st.cache_data(ttl=timedelta(hours=12), show_spinner=False)
+def _fetch_cpi_range(start_year, start_month, end_year, end_month):
     """
-    שולפת את ערך מדד המחירים לצרכן ותיאור הבסיס עבור שנה וחודש ספציפיים.
+    שולפת בבקשה אחת את ערכי מדד המחירים לצרכן לכל החודשים בטווח המבוקש (כולל).
+    מחזירה מילון {(שנה, חודש): CpiEntry}; חודש שטרם פורסם לא יופיע בו.
+    פונקציה ללא תופעות לוואי בממשק: שגיאות נזרקות כחריגות, ולכן גם אינן נשמרות במטמון.
     """
-    period_str = get_date_for_cpi_lookup(year, month)
+    start_ordinal = start_year * 12 + start_month
+    end_ordinal = end_year * 12 + end_month
+    if start_ordinal > end_ordinal:
+        return {}
+
+    cpi_values = _read_persistent_cpi(start_year, start_month, end_year, end_month)
+
+    # נשלפים מה-API רק החודשים שאינם במטמון, החל מהחודש החסר הראשון
+    cached_ordinals = {year * 12 + month for year, month in cpi_values}
+    first_missing_ordinal = next(
+        (ordinal for ordinal in range(start_ordinal, end_ordinal + 1) if ordinal not in cached_ordinals), None
+    )
+    if first_missing_ordinal is None:
+        return cpi_values
+
+    fetch_year, fetch_month = divmod(first_missing_ordinal - 1, 12)
+    fetch_month += 1
     query_params = {
         "id": CPI_RESOURCE_ID,
-        "format": "xml",
+        "format": "json",
         "download": "false",
-        "period": period_str,
+        "startPeriod": get_date_for_cpi_lookup(fetch_year, fetch_month),
+        "endPeriod": get_date_for_cpi_lookup(end_year, end_month),
+        "PageSize": end_ordinal - first_missing_ordinal + 1,
     }
 
-    try:
-        response = requests.get(DATA_GOV_IL_API_URL, params=query_params)
+    # השרת עשוי לפצל טווח ארוך לכמה עמודים; ממשיכים לפי בלוק ה-paging עד העמוד האחרון,
+    # כדי שחודשים בסוף הטווח לא ייראו כאילו טרם פורסמו
+    fetched_values = {}
+    session = _get_http_session()
+    page = 1
+    while True:
+        response = session.get(DATA_GOV_IL_API_URL, params={**query_params, "Page": page}, timeout=(3, 10))
         response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-        xml_data = response.text
-
-        root = ET.fromstring(xml_data)
-
-        date_month_elements = root.findall('.//DateMonth')
-        date_month_element = None
-        for dm_elem in date_month_elements:
-            y_elem = dm_elem.find('year')
-            m_elem = dm_elem.find('month')
-            if y_elem is not None and m_elem is not None and int(y_elem.text) == year and int(m_elem.text) == month:
-                date_month_element = dm_elem
-                break
-
-        if date_month_element is not None:
-            value_element = date_month_element.find('currBase/value')
-            base_desc_element = date_month_element.find('currBase/baseDesc')
-            month_desc_element = date_month_element.find('monthDesc') # Added for display
-
-            cpi_value = float(value_element.text) if value_element is not None and value_element.text else None
-            base_desc = base_desc_element.text if base_desc_element is not None and base_desc_element.text else None
-            month_desc = month_desc_element.text if month_desc_element is not None and month_desc_element.text else f"{month:02d}"
-
-            if cpi_value is not None and base_desc is not None:
-                return cpi_value, base_desc, month_desc
-            else:
-                return None, None, None
-        else:
-            return None, None, None
 
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+
+        if not isinstance(payload, dict):
+            fetched_values.update(_parse_cpi_xml(response.content))
+            break
+
+        fetched_values.update(_parse_cpi_json(payload))
+        paging = payload.get("paging") or {}
+        last_page = int(paging.get("last_page") or page)
+        if page >= last_page:
+            break
+        page += 1
+
+    fetched_values = {
+        key: value for key, value in fetched_values.items()
+        if start_ordinal <= key[0] * 12 + key[1] <= end_ordinal
+    }
+    _store_persistent_cpi(fetched_values)
+    cpi_values.update(fetched_values)
+    return cpi_values
+
+
+def get_cpi_range(start_year, start_month, end_year, end_month):
+    """
+    מחזירה (מדדים, האם השליפה הצליחה) עבור הטווח המבוקש מ-_fetch_cpi_range, ומדווחת בממשק על שגיאת שליפה.
+    במקרה של שגיאה מוחזרים המדדים שכבר שמורים במטמון הקבוע (אם יש).
+    """
+    period_desc = f"{start_month:02d}/{start_year}-{end_month:02d}/{end_year}"
+    try:
+        return _fetch_cpi_range(start_year, start_month, end_year, end_month), True
     except requests.exceptions.RequestException as e:
-        st.error(f"שגיאת רשת בעת שליפת נתונים עבור {month:02d}/{year}: {e}")
-        return None, None, None
+        error_message = f"שגיאת רשת בעת שליפת נתונים עבור {period_desc}: {e}"
     except ET.ParseError as e:
-        st.error(f"שגיאה בניתוח XML עבור {month:02d}/{year}: {e}. תוכן התגובה: {xml_data[:500]}...")
-        return None, None, None
-    except (ValueError, KeyError, AttributeError) as e: # Added AttributeError for safety
-        st.error(f"שגיאה בנתונים שהתקבלו עבור {month:02d}/{year}: {e}")
+        error_message = f"שגיאה בניתוח XML עבור {period_desc}: {e}"
+    except (ValueError, KeyError, AttributeError, TypeError) as e: # Added AttributeError for safety
+        error_message = f"שגיאה בנתונים שהתקבלו עבור {period_desc}: {e}"
+
+    st.error(error_message)
+    return _read_persistent_cpi(start_year, start_month, end_year, end_month), False
+
+
+def get_cpi_value_and_base(cpi_values, year, month):
+    """
+    מחזירה את ערך המדד, תיאור הבסיס ותיאור החודש עבור שנה וחודש ספציפיים,
+    מתוך מילון מדדים שנשלף מראש ב-get_cpi_range. חודש חסר מחזיר None בכל השדות.
+    """
+    entry = cpi_values.get((year, month))
+    if entry is None:
         return None, None, None
+    return entry.value, entry.base_desc, entry.month_desc
+
+
+# --- פונקציות לחישוב מקדם הקשר השנתי ---
+def count_linkage_years(base_effective_date, billing_year, billing_month, billing_day):
+    """
+    מחזירה את מספר הפעמים שחל מועד מקדם הקשר (28 בפברואר) אחרי תאריך התוקף ועד תאריך החיוב (כולל).
+    חישוב ישיר ללא לולאה על השנים; פועל גם על מערכי NumPy של שנה/חודש/יום חיוב.
+    """
+    base_past_anchor = (base_effective_date.month, base_effective_date.day) >= (LINKAGE_ANCHOR_MONTH, LINKAGE_ANCHOR_DAY)
+    billing_past_anchor = (billing_month > LINKAGE_ANCHOR_MONTH) | (
+        (billing_month == LINKAGE_ANCHOR_MONTH) & (billing_day >= LINKAGE_ANCHOR_DAY)
+    )
+    return np.maximum(billing_year - base_effective_date.year - base_past_anchor + billing_past_anchor, 0)
+
+
+def get_annual_linkage_multiplier(base_effective_date, current_billing_date):
+    """
+    מחזירה את מקדם הקשר השנתי המצטבר בין תאריך התוקף לתאריך החיוב.
+    """
+    num_years_for_factor = int(count_linkage_years(
+        base_effective_date, current_billing_date.year, current_billing_date.month, current_billing_date.day
+    ))
+    return ANNUAL_LINKAGE_FACTOR ** num_years_for_factor
 
 
 # --- פונקציה לחישוב סכום מוצמד ביחס לבסיס קבוע (הצמדה חוזרת לבסיס) ---
@@ -115,7 +420,7 @@ def calculate_indexed_amount_from_fixed_base(
     מחשבת את הסכום המוצמד מחדש בהתבסס על סכום בסיס קבוע ומדד בסיס קבוע,
     ביחס למדד של התקופה הנוכחית, בתוספת מקדם קשר שנתי.
     הנוסחה: סכום בסיס * (מדד נוכחי / מדד בסיס) * (מקדם קשר)^מספר_שנים
-    מקדם הקשר חל החל מה-17 בינואר בכל שנה.
+    מקדם הקשר חל החל מה-28 בפברואר בכל שנה.
     """
     if (
         fixed_base_cpi_value is None
@@ -127,28 +432,7 @@ def calculate_indexed_amount_from_fixed_base(
     # Calculate the CPI-indexed portion first
     cpi_indexed_amount = base_amount * (current_period_cpi_value / fixed_base_cpi_value)
 
-    # Calculate the annual linkage factor based on January 17th
-    num_years_for_factor = 0
-    
-    # Determine the starting year for counting factors
-    # The first Jan 17th *after* the base effective date (including Jan 17th of current year if base is before it).
-    
-    start_year_for_factor_check = base_effective_date.year
-    # If base_effective_date is on or after Jan 17th of its year,
-    # the first potential annual factor application is Jan 17th of the *next* year.
-    if base_effective_date.month > 2 or (base_effective_date.month == 2 and base_effective_date.day >= 28):
-        start_year_for_factor_check += 1
-
-    # Iterate from `start_year_for_factor_check` up to the `current_billing_date.year`
-    for year_to_check_factor in range(start_year_for_factor_check, current_billing_date.year + 1):
-        jan_17_of_check_year = datetime(year_to_check_factor, 2, 28)
-        
-        # If this January 17th has passed or is today compared to the current_billing_date,
-        # then we count this year's factor.
-        if jan_17_of_check_year <= current_billing_date:
-            num_years_for_factor = 1
-
-    annual_linkage_multiplier = ANNUAL_LINKAGE_FACTOR ** num_years_for_factor
+    annual_linkage_multiplier = get_annual_linkage_multiplier(base_effective_date, current_billing_date)
     
     final_amount = cpi_indexed_amount * annual_linkage_multiplier
 
@@ -162,9 +446,120 @@ def get_cpi_month_for_effective_date(effective_date):
     המדד מתפרסם ב-15 לחודש עבור חודשיים קודם.
     כלומר, עבור תאריך אפקטיבי/עדכון בחודש X, המדד הרלוונטי הוא של חודש X-2.
     """
-    cpi_date = effective_date - pd.DateOffset(months=2)
-    
-    return cpi_date.year, cpi_date.month
+    return shift_month(effective_date.year, effective_date.month, -2)
+
+
+# --- פונקציה למציאת חודש המדד האחרון שפורסם ---
+def latest_published_cpi_month(today):
+    """
+    מחזירה את השנה והחודש של המדד האחרון שכבר פורסם נכון לתאריך הנתון.
+    המדד של חודש X מתפרסם ב-15 לחודש X+1, ולכן לפני ה-15 המדד האחרון הוא של חודשיים קודם.
+    """
+    # Month ordinal minus a lag of 1, or 2 before the 15th; cannot land on a future month
+    year, month_index = divmod(today.year * 12 + today.month - 2 - (today.day < 15), 12)
+    return year, month_index + 1
+
+
+# --- בניית טבלת היסטוריית העדכונים ---
+@st.cache_data(ttl=timedelta(hours=12), show_spinner=False)
+def build_history_dataframe(base_mizono_amount, base_effective_year, base_effective_month, update_frequency_months, billing_day, today_date):
+    """
+    בונה את טבלת היסטוריית העדכונים ושומרת אותה במטמון: הרצה חוזרת של הדף (למשל שינוי ווידג'ט אחר) לא מחשבת אותה מחדש.
+    המדדים נשלפים ישירות מ-_fetch_cpi_range, ולכן שגיאת שליפה נזרקת כחריגה ואינה נשמרת במטמון יחד עם טבלה חלקית.
+    """
+    fixed_base_cpi_year, fixed_base_cpi_month = get_cpi_month_for_effective_date(datetime(base_effective_year, base_effective_month, 1))
+    cpi_values = _fetch_cpi_range(fixed_base_cpi_year, fixed_base_cpi_month, *latest_published_cpi_month(today_date))
+    return build_history_table(
+        cpi_values, base_mizono_amount, base_effective_year, base_effective_month, update_frequency_months, billing_day, today_date
+    )
+
+
+def build_history_table(cpi_values, base_mizono_amount, base_effective_year, base_effective_month, update_frequency_months, billing_day, today_date):
+    """
+    בונה את טבלת היסטוריית העדכונים מתוך מילון מדדים נתון, מתאריך התוקף ועד חודשיים קדימה מהיום, ממוינת מהחדש לישן.
+    מחזירה את הטבלה יחד עם שתי מסכות שורות: נקודות עדכון שהמדד שלהן טרם פורסם, ושורות שהסכום בהן הוא אומדן.
+    מחזירה None אם אין שורות להצגה.
+    """
+    today = datetime.combine(today_date, datetime.min.time())
+    base_effective_date_obj = datetime(base_effective_year, base_effective_month, 1)
+
+    fixed_base_cpi_year, fixed_base_cpi_month = get_cpi_month_for_effective_date(base_effective_date_obj)
+    fixed_base_cpi_value, _, fixed_base_cpi_month_desc = get_cpi_value_and_base(cpi_values, fixed_base_cpi_year, fixed_base_cpi_month)
+    if not fixed_base_cpi_value:
+        return None
+
+    # Limit scanning up to a point slightly beyond today to show future estimated updates
+    # Today (May 19, 2025). We want to show up to July 2025 (2 months ahead).
+    # The effective date for July would look up May CPI.
+    # So the scan ends at the month 2 months from today.
+    scan_end_year, scan_end_month = shift_month(today.year, today.month, 2)
+
+    # כל חודשי הסריקה כמערך חודשים אחד (datetime64[M]), בלי אובייקטי תאריך של pandas.
+    # הסריקה מתחילה בתאריך התוקף, ולכן נקודות העדכון הרשמיות הן בדיוק כל שורה
+    # ה-update_frequency_months-ית, והחישוב הפרטני נעשה רק עליהן.
+    scan_months = np.arange(
+        np.datetime64(f"{base_effective_year:04d}-{base_effective_month:02d}", "M"),
+        np.datetime64(f"{scan_end_year:04d}-{scan_end_month:02d}", "M") + 1,
+    )
+    if len(scan_months) == 0:
+        return None
+
+    scan_years, scan_month_indices = np.divmod(scan_months.astype(np.int64), 12)
+    scan_years += 1970 # datetime64[M] נספר מינואר 1970
+    scan_month_numbers = scan_month_indices + 1
+    scan_dates = scan_months.astype("datetime64[D]")
+    days_in_month = ((scan_months + 1).astype("datetime64[D]") - scan_dates).astype(np.int64)
+
+    update_rows = np.arange(0, len(scan_months), update_frequency_months)
+    is_update_point = np.zeros(len(scan_months), dtype=bool)
+    is_update_point[update_rows] = True
+
+    # מדד העדכון של כל נקודת עדכון (NaN אם טרם פורסם או שאין עדכון בחודש זה)
+    update_cpi_months = [
+        shift_month(int(year), int(month), -2) for year, month in zip(scan_years[update_rows], scan_month_numbers[update_rows])
+    ]
+    update_cpi_entries = [get_cpi_value_and_base(cpi_values, year, month) for year, month in update_cpi_months]
+    cpi_for_update = np.full(len(scan_months), np.nan)
+    cpi_for_update[update_rows] = [value if value is not None else np.nan for value, _, _ in update_cpi_entries]
+    has_cpi = ~np.isnan(cpi_for_update)
+
+    # מקדם הקשר נקבע לפי יום החיוב בכל נקודת עדכון (יום חיוב שאינו קיים בחודש יורד ליום האחרון בחודש)
+    billing_days = np.minimum(billing_day, days_in_month)
+    linkage_years = count_linkage_years(base_effective_date_obj, scan_years, scan_month_numbers, billing_days)
+    linkage_multipliers = np.where(has_cpi, ANNUAL_LINKAGE_FACTOR ** linkage_years, np.nan)
+
+    cpi_ratios = cpi_for_update / fixed_base_cpi_value
+    # הגרסה הווקטורית של calculate_indexed_amount_from_fixed_base; יחס NaN (אין עדכון או שהמדד טרם פורסם) מניב סכום NaN
+    indexed_amounts = base_mizono_amount * cpi_ratios * linkage_multipliers
+    # הסכום נשאר קבוע בין נקודות עדכון ובנקודות שהמדד שלהן טרם פורסם
+    last_computed_row = np.maximum.accumulate(np.where(has_cpi, np.arange(len(scan_months)), -1))
+    displayed_amounts = np.where(last_computed_row >= 0, indexed_amounts[last_computed_row], base_mizono_amount)
+    # נקודת עדכון שהמדד שלה טרם פורסם מציגה אומדן, וכך גם החודשים שאחריה עד נקודת העדכון הבאה
+    pending_rows = is_update_point & ~has_cpi
+    last_update_row = np.maximum.accumulate(np.where(is_update_point, np.arange(len(scan_months)), -1))
+    estimate_rows = pending_rows[last_update_row]
+
+    base_cpi_val_str = f"{fixed_base_cpi_value:.2f} ({fixed_base_cpi_month_desc} {fixed_base_cpi_year})"
+    update_cpi_strs = np.full(len(scan_months), "", dtype=object)
+    update_cpi_strs[update_rows] = [
+        f"{value:.2f} ({month_desc} {year})" if value is not None else f"טרם פורסם ({HEBREW_MONTHS[month]} {year})"
+        for (year, month), (value, _, month_desc) in zip(update_cpi_months, update_cpi_entries)
+    ]
+
+    # העמודות נבנות ישירות בסדר יורד (מהחדש לישן), בלי מיון או המרת תאריכים למחרוזות ובחזרה
+    newest_first = slice(None, None, -1)
+    df_history = pd.DataFrame(
+        {
+            "תאריך עדכון (אפקטיבי)": scan_dates[newest_first],
+            "מדד בסיס": np.where(is_update_point, base_cpi_val_str, "")[newest_first],
+            "מדד עדכון": update_cpi_strs[newest_first],
+            "שינוי מדד בלבד (%)": ((cpi_ratios - 1) * 100)[newest_first],
+            "מקדם שנתי": linkage_multipliers[newest_first],
+            "שינוי כולל (%)": ((cpi_ratios * linkage_multipliers - 1) * 100)[newest_first],
+            "סכום מעודכן": displayed_amounts[newest_first],
+        }
+    )
+    return df_history, pending_rows[newest_first], estimate_rows[newest_first]
 
 
 # --- לוגיקה של אפליקציית Streamlit ---
@@ -197,7 +592,7 @@ def main():
             "חודש תוקף פסק הדין/ההסכם (תאריך אפקטיבי):",
             options=list(range(1, 13)),
             index=4,  # מאי (חודש 5)
-            format_func=lambda x: datetime(1, x, 1).strftime('%B').replace('January','ינואר').replace('February','פברואר').replace('March','מרץ').replace('April','אפריל').replace('May','מאי').replace('June','יוני').replace('July','יולי').replace('August','אוגוסט').replace('September','ספטמבר').replace('October','אוקטובר').replace('November','נובמבר').replace('December','דצמבר')
+            format_func=HEBREW_MONTHS.get
         )
     with col2:
         base_effective_year_input = st.number_input(
@@ -246,12 +641,16 @@ def main():
             # המדד שישמש כ"מדד בסיס קבוע" לכל ההצמדות,
             # נגזר מתאריך התוקף של פסק הדין (חודשיים לפניו).
             fixed_base_cpi_year, fixed_base_cpi_month = get_cpi_month_for_effective_date(base_effective_date_obj)
-            
-            fixed_base_cpi_value, fixed_base_cpi_base_desc, fixed_base_cpi_month_desc = get_cpi_value_and_base(fixed_base_cpi_year, fixed_base_cpi_month)
+
+            # שליפה אחת של כל המדדים הנדרשים, ממדד הבסיס ועד החודש הנוכחי
+            today = datetime.now()
+            cpi_values, cpi_fetched_ok = get_cpi_range(fixed_base_cpi_year, fixed_base_cpi_month, *latest_published_cpi_month(today))
+
+            fixed_base_cpi_value, fixed_base_cpi_base_desc, fixed_base_cpi_month_desc = get_cpi_value_and_base(cpi_values, fixed_base_cpi_year, fixed_base_cpi_month)
 
             if fixed_base_cpi_value is None:
                 st.error(
-                    f"שגיאה: לא ניתן היה לשלוף את מדד הבסיס הקבוע עבור {fixed_base_cpi_month_desc} {fixed_base_cpi_year}. "
+                    f"שגיאה: לא ניתן היה לשלוף את מדד הבסיס הקבוע עבור {HEBREW_MONTHS[fixed_base_cpi_month]} {fixed_base_cpi_year}. "
                     "אנא וודא שתאריך התוקף נבחר כהלכה וכי נתוני המדד זמינים עבור חודש זה (מדד מתפרסם חודשיים אחורה)."
                 )
                 return
@@ -259,24 +658,17 @@ def main():
             st.info(f"מדד בסיס קבוע (נגזר מתאריך התוקף {base_effective_month:02d}/{base_effective_year}): **{fixed_base_cpi_value:.2f}** (חודש המדד: {fixed_base_cpi_month_desc} {fixed_base_cpi_year}, בסיס: {fixed_base_cpi_base_desc})")
 
             # --- חישוב הסכום העדכני ביותר (התוצאה הסופית) ---
-            today = datetime.now()
-            
             # תאריך חיוב נוכחי עבור החישוב הסופי (בשילוב עם יום החיוב שהוזן)
-            try:
-                current_billing_date_for_final_calc = datetime(today.year, today.month, billing_day_input)
-            except ValueError:
-                # If current day is before billing_day_input, use current day for calculation consistency
-                # Or, if billing_day_input is not valid for the current month, use last day of month.
-                # For simplicity and to match the logic of Jan 17, let's use the first day of the month for CPI lookup
-                # and then adjust the billing date to actual billing day for factor calculation.
-                current_billing_date_for_final_calc = datetime(today.year, today.month, min(billing_day_input, (datetime(today.year, today.month % 12 + 1, 1) - timedelta(days=1)).day))
-
+            # יום חיוב שאינו קיים בחודש הנוכחי (למשל 31 בחודש של 30 יום) יורד ליום האחרון בחודש
+            current_billing_date_for_final_calc = datetime(
+                today.year, today.month, min(billing_day_input, calendar.monthrange(today.year, today.month)[1])
+            )
 
             # המדד שיש להצמיד אליו היום, נגזר מתאריך היום (חודשיים לפניו).
             current_period_cpi_year, current_period_cpi_month = get_cpi_month_for_effective_date(today)
             
             current_period_cpi_value_for_final_calc, _, current_period_cpi_month_desc_for_final_calc = get_cpi_value_and_base( # Ignore base_desc for current period, use fixed_base_cpi_base_desc
-                current_period_cpi_year, current_period_cpi_month
+                cpi_values, current_period_cpi_year, current_period_cpi_month
             )
 
             # לוגיקה לטיפול במדד חסר עבור החישוב הסופי
@@ -286,28 +678,23 @@ def main():
                 
                 # במקרה של חוסר מדד לחישוב הסופי, נשלוף את המדד האחרון שכן זמין ונשתמש בו
                 # כדי להציג את הסכום המוצמד האחרון האפשרי.
-                # נסרוק אחורה מתאריך המדד שהיה אמור להתפרסם, עד שנמצא מדד זמין.
-                temp_cpi_lookup_date = datetime(current_period_cpi_year, current_period_cpi_month, 1) - pd.DateOffset(months=1) # Start from the month BEFORE the missing CPI
-                found_last_cpi = False
-                while temp_cpi_lookup_date >= datetime(fixed_base_cpi_year, fixed_base_cpi_month, 1): # Don't go before fixed base CPI month
-                    last_available_cpi_value, _, last_available_cpi_month_desc = get_cpi_value_and_base(
-                        temp_cpi_lookup_date.year, temp_cpi_lookup_date.month
-                    )
-                    if last_available_cpi_value is not None:
-                        current_period_cpi_value_for_final_calc = last_available_cpi_value
-                        current_period_cpi_month_desc_for_final_calc = last_available_cpi_month_desc
-                        st.warning(
-                            f"אזהרה: המדד לחודש {datetime(current_period_cpi_year, current_period_cpi_month, 1).strftime('%B').replace('January','ינואר').replace('February','פברואר').replace('March','מרץ').replace('April','אפריל').replace('May','מאי').replace('June','יוני').replace('July','יולי').replace('August','אוגוסט').replace('September','ספטמבר').replace('October','אוקטובר').replace('November','נובמבר').replace('December','דצמבר')} {current_period_cpi_year} טרם פורסם. "
-                            f"הסכום המוצג הוא הערכה על בסיס המדד האחרון הזמין (חודש מדד {last_available_cpi_month_desc} {temp_cpi_lookup_date.year})."
-                        )
-                        found_last_cpi = True
-                        break
-                    temp_cpi_lookup_date -= pd.DateOffset(months=1)
-                
-                if not found_last_cpi:
-                    final_updated_mizono_amount = base_mizono_amount # Fallback to base if no CPI data found at all
+                # המילון cpi_values מתחיל במדד הבסיס ומכיל רק חודשים שפורסמו, ולכן המדד האחרון הזמין
+                # הוא המפתח הגדול ביותר שקודם לחודש החסר - בלי סריקה חודש אחר חודש.
+                last_available_month = max(
+                    (key for key in cpi_values if key < (current_period_cpi_year, current_period_cpi_month)), default=None
+                )
+                if last_available_month is None:
                     st.error("לא נמצאו נתוני מדד זמינים לחישוב הסכום העדכני. מציג את סכום הבסיס.")
                     return # Exit if no data
+
+                lookup_year, lookup_month = last_available_month
+                current_period_cpi_value_for_final_calc, _, current_period_cpi_month_desc_for_final_calc = get_cpi_value_and_base(
+                    cpi_values, lookup_year, lookup_month
+                )
+                st.warning(
+                    f"אזהרה: המדד לחודש {HEBREW_MONTHS[current_period_cpi_month]} {current_period_cpi_year} טרם פורסם. "
+                    f"הסכום המוצג הוא הערכה על בסיס המדד האחרון הזמין (חודש מדד {current_period_cpi_month_desc_for_final_calc} {lookup_year})."
+                )
             else:
                 st.info(
                     f"מדד עדכון נוכחי (נגזר מהיום): **{current_period_cpi_value_for_final_calc:.2f}** (חודש המדד: {current_period_cpi_month_desc_for_final_calc} {current_period_cpi_year}, בסיס: {fixed_base_cpi_base_desc})"
@@ -330,10 +717,13 @@ def main():
                 st.info(f"מקדם הצמדה שנתי: {annual_linkage_multiplier_final:.4f} (מבוסס על {ANNUAL_LINKAGE_FACTOR:.3f} לשנה)")
 
                 # חישוב תאריך העדכון הבא המשוער (בהתאם לתדירות שהוזנה)
-                next_update_display_date = base_effective_date_obj
-                while next_update_display_date <= today:
-                    next_update_display_date += pd.DateOffset(months=update_frequency_months)
-                
+                # נקודת העדכון הראשונה שאחרי היום, בחישוב ישיר על מספר החודשים מתאריך התוקף
+                months_since_base = (today.year - base_effective_year) * 12 + (today.month - base_effective_month)
+                update_steps = max(0, months_since_base // update_frequency_months + 1)
+                next_update_display_date = datetime(
+                    *shift_month(base_effective_year, base_effective_month, update_steps * update_frequency_months), 1
+                )
+
                 st.info(f"**תאריך העדכון הבא המשוער (לפי תדירות שהוזנה):** {next_update_display_date.strftime('%d/%m/%Y')}")
 
 
@@ -345,128 +735,42 @@ def main():
                     """, unsafe_allow_html=True
                 )
 
-                # בניית טבלה להצגת היסטוריית עדכונים
-                history_data = []
-                
-                current_displayed_amount_in_history = base_mizono_amount 
-                
-                current_scan_date = base_effective_date_obj
-                
-                next_update_calc_date = base_effective_date_obj 
-
-                # Limit scanning up to a point slightly beyond today to show future estimated updates
-                # Today (May 19, 2025). We want to show up to July 2025 (2 months ahead).
-                # The effective date for July would look up May CPI.
-                # So max_scan_limit_date should be 2 months from today, at the end of the month.
-                max_scan_limit_date = (today + pd.DateOffset(months=2)).replace(day=1) + pd.DateOffset(months=1) - timedelta(days=1)
-                
-                while current_scan_date <= max_scan_limit_date:
-                    is_official_update_point = False
-                    if (current_scan_date.year == next_update_calc_date.year and 
-                        current_scan_date.month == next_update_calc_date.month):
-                        is_official_update_point = True
-                    
-                    if is_official_update_point:
-                        # Construct the billing date for this specific update point
-                        try:
-                            current_history_billing_date = datetime(current_scan_date.year, current_scan_date.month, billing_day_input)
-                        except ValueError:
-                            # Handle cases where billing_day_input is invalid for a specific month (e.g., Feb 30)
-                            # Default to last day of month
-                            current_history_billing_date = datetime(current_scan_date.year, current_scan_date.month, 
-                                                            min(billing_day_input, (datetime(current_scan_date.year, current_scan_date.month % 12 + 1, 1) - timedelta(days=1)).day))
-
-
-                        cpi_for_update_year, cpi_for_update_month = get_cpi_month_for_effective_date(current_scan_date)
-                        cpi_for_update_value, _, cpi_for_update_month_desc = get_cpi_value_and_base(
-                            cpi_for_update_year, cpi_for_update_month
-                        )
-                        
-                        # Initialize columns for this row
-                        base_cpi_val_str = f"{fixed_base_cpi_value:.2f} ({fixed_base_cpi_month_desc} {fixed_base_cpi_year})"
-                        current_cpi_val_str = ""
-                        cpi_only_change_percent = ""
-                        annual_factor_val_str = ""
-                        total_change_percent = ""
-
-                        if cpi_for_update_value is None:
-                            current_cpi_val_str = f"טרם פורסם ({cpi_for_update_month_desc} {cpi_for_update_year})"
-                            # Keep the last calculated amount
-                            history_data.append(
-                                {
-                                    "תאריך עדכון (אפקטיבי)": current_scan_date.strftime("%d/%m/%Y"),
-                                    "מדד בסיס": base_cpi_val_str,
-                                    "מדד עדכון": current_cpi_val_str,
-                                    "שינוי מדד בלבד (%)": "N/A",
-                                    "מקדם שנתי": "N/A",
-                                    "שינוי כולל (%)": "N/A",
-                                    "סכום מעודכן": f"{current_displayed_amount_in_history:.2f} ש\"ח (אומדן - מדד טרם פורסם)",
-                                }
-                            )
-                        else:
-                            # If CPI data is available, perform indexation calculation
-                            calculated_amount_with_factor, annual_linkage_multiplier_hist = calculate_indexed_amount_from_fixed_base(
-                                base_mizono_amount,
-                                fixed_base_cpi_value,
-                                cpi_for_update_value,
-                                base_effective_date_obj,
-                                current_history_billing_date # Pass the billing date for this update point
-                            )
-                            
-                            if calculated_amount_with_factor is not None:
-                                current_displayed_amount_in_history = calculated_amount_with_factor # Update the displayed amount
-                                
-                                current_cpi_val_str = f"{cpi_for_update_value:.2f} ({cpi_for_update_month_desc} {cpi_for_update_year})"
-                                
-                                cpi_only_change_percent = ((cpi_for_update_value / fixed_base_cpi_value) - 1) * 100
-                                
-                                annual_factor_val_str = f"{annual_linkage_multiplier_hist:.4f}"
-                                if annual_linkage_multiplier_hist > 1:
-                                    total_change_percent = ((calculated_amount_with_factor / base_mizono_amount) - 1) * 100
-                                else:
-                                    total_change_percent = cpi_only_change_percent # If no annual factor, total change is just CPI change
-
-                                history_data.append(
-                                    {
-                                        "תאריך עדכון (אפקטיבי)": current_scan_date.strftime("%d/%m/%Y"),
-                                        "מדד בסיס": base_cpi_val_str,
-                                        "מדד עדכון": current_cpi_val_str,
-                                        "שינוי מדד בלבד (%)": f"{cpi_only_change_percent:.2f}%",
-                                        "מקדם שנתי": annual_factor_val_str,
-                                        "שינוי כולל (%)": f"{total_change_percent:.2f}%",
-                                        "סכום מעודכן": f"{current_displayed_amount_in_history:.2f} ש\"ח",
-                                    }
-                                )
-                            else:
-                                st.warning(f"לא ניתן לחשב סכום מעודכן עבור תאריך {current_scan_date.strftime('%d/%m/%Y')}.")
-                                break # Stop if calculation fails
-                        
-                        next_update_calc_date += pd.DateOffset(months=update_frequency_months) # Advance to the next update date
-
-                    else: # If this is not an official update month, the amount remains the same
-                        # For non-update points, we still show the last calculated amount
-                        history_data.append(
-                            {
-                                "תאריך עדכון (אפקטיבי)": current_scan_date.strftime("%d/%m/%Y"),
-                                "מדד בסיס": "",
-                                "מדד עדכון": "",
-                                "שינוי מדד בלבד (%)": "",
-                                "מקדם שנתי": "",
-                                "שינוי כולל (%)": "",
-                                "סכום מעודכן": f"{current_displayed_amount_in_history:.2f} ש\"ח", # Displays the last calculated amount
-                            }
-                        )
-                    
-                    current_scan_date += pd.DateOffset(months=1) # Advance to the next month
-                
-                if history_data:
-                    df_history = pd.DataFrame(history_data)
-                    # Convert to datetime for sorting, then back to string for display
-                    df_history['תאריך עדכון (אפקטיבי)'] = pd.to_datetime(df_history['תאריך עדכון (אפקטיבי)'], format="%d/%m/%Y")
-                    df_history_sorted = df_history.sort_values(by="תאריך עדכון (אפקטיבי)", ascending=False)
-                    df_history_sorted['תאריך עדכון (אפקטיבי)'] = df_history_sorted['תאריך עדכון (אפקטיבי)'].dt.strftime("%d/%m/%Y")
-                    
-                    st.dataframe(df_history_sorted, hide_index=True)
+                history_inputs = (
+                    base_mizono_amount,
+                    base_effective_year,
+                    base_effective_month,
+                    update_frequency_months,
+                    billing_day_input,
+                    today.date(),
+                )
+                if cpi_fetched_ok:
+                    history = build_history_dataframe(*history_inputs)
+                else:
+                    # השליפה נכשלה (השגיאה כבר דווחה למעלה): הטבלה נבנית מהמדדים שבידינו, בלי לשמור אותה במטמון
+                    # ובלי לחזור על השליפה מהלמ"ס
+                    history = build_history_table(cpi_values, *history_inputs)
+
+                if history is not None:
+                    df_history_sorted, pending_rows, estimate_rows = history
+                    history_styler = df_history_sorted.style.format(
+                        {
+                            "תאריך עדכון (אפקטיבי)": lambda d: d.strftime("%d/%m/%Y"),
+                            "שינוי מדד בלבד (%)": "{:.2f}%",
+                            "מקדם שנתי": "{:.4f}",
+                            "שינוי כולל (%)": "{:.2f}%",
+                            "סכום מעודכן": "{:.2f} ש\"ח",
+                        },
+                        na_rep="",
+                    )
+                    # נקודת עדכון שהמדד שלה טרם פורסם מסומנת N/A, וסכום שהוא אומדן מסומן ככזה
+                    history_styler.format(
+                        na_rep="N/A",
+                        subset=pd.IndexSlice[pending_rows, ["שינוי מדד בלבד (%)", "מקדם שנתי", "שינוי כולל (%)"]],
+                    )
+                    history_styler.format(
+                        "{:.2f} ש\"ח (אומדן - מדד טרם פורסם)", subset=pd.IndexSlice[estimate_rows, "סכום מעודכן"]
+                    )
+                    st.dataframe(history_styler, hide_index=True)
                 else:
                     st.write("אין היסטוריית עדכונים להצגה כרגע בטווח המבוקש.")
 
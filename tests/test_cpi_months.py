@@ -0,0 +1,49 @@
+"""
+בדיקות לחישובי החודשים שקובעים את טווח השליפה: המדד האחרון שפורסם, והזזת (שנה, חודש).
+"""
+from datetime import date, datetime
+
+import pytest
+
+from mizon_app2 import latest_published_cpi_month, shift_month
+
+
+@pytest.mark.parametrize(
+    "today, expected_month",
+    [
+        # המדד של חודש X מתפרסם ב-15 לחודש X+1
+        (date(2025, 5, 14), (2025, 3)),
+        (date(2025, 5, 15), (2025, 4)),
+        (date(2025, 5, 31), (2025, 4)),
+        # ינואר: חוזרים לנובמבר או לדצמבר של השנה הקודמת
+        (date(2025, 1, 1), (2024, 11)),
+        (date(2025, 1, 14), (2024, 11)),
+        (date(2025, 1, 15), (2024, 12)),
+        # תחילת פברואר: המדד האחרון עדיין של דצמבר
+        (date(2025, 2, 1), (2024, 12)),
+        (date(2025, 2, 14), (2024, 12)),
+        (date(2025, 2, 15), (2025, 1)),
+        (date(2024, 12, 31), (2024, 11)),
+    ],
+)
+def test_latest_published_cpi_month(today, expected_month):
+    assert latest_published_cpi_month(today) == expected_month
+    # main() מעביר datetime ו-build_history_dataframe מעבירה date
+    assert latest_published_cpi_month(datetime(today.year, today.month, today.day, 23, 59)) == expected_month
+
+
+@pytest.mark.parametrize(
+    "year, month, months, expected_month",
+    [
+        (2024, 3, -2, (2024, 1)),
+        (2025, 1, -1, (2024, 12)),
+        (2025, 2, -2, (2024, 12)),
+        (2025, 2, -14, (2023, 12)),
+        (2025, 1, -25, (2022, 12)),
+        (2024, 12, 1, (2025, 1)),
+        (2024, 11, 2, (2025, 1)),
+        (2024, 6, 0, (2024, 6)),
+    ],
+)
+def test_shift_month(year, month, months, expected_month):
+    assert shift_month(year, month, months) == expected_month
@@ -0,0 +1,83 @@
+"""
+בדיקה של ספירת שנות מקדם הקשר בנוסחה הסגורה (count_linkage_years) מול הלולאה המקורית,
+לאחר תיקון ההשמה num_years_for_factor = 1 להוספה (+= 1).
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+from mizon_app2 import ANNUAL_LINKAGE_FACTOR, count_linkage_years, get_annual_linkage_multiplier
+
+
+def loop_linkage_years(base_effective_date, current_billing_date):
+    # הלולאה מ-calculate_indexed_amount_from_fixed_base לפני המעבר לנוסחה הסגורה, עם התיקון בלבד
+    num_years_for_factor = 0
+    start_year_for_factor_check = base_effective_date.year
+    if base_effective_date.month > 2 or (base_effective_date.month == 2 and base_effective_date.day >= 28):
+        start_year_for_factor_check += 1
+    for year_to_check_factor in range(start_year_for_factor_check, current_billing_date.year + 1):
+        if datetime(year_to_check_factor, 2, 28) <= current_billing_date:
+            num_years_for_factor += 1
+    return num_years_for_factor
+
+
+def closed_form_linkage_years(base_effective_date, current_billing_date):
+    return int(count_linkage_years(
+        base_effective_date, current_billing_date.year, current_billing_date.month, current_billing_date.day
+    ))
+
+
+@pytest.mark.parametrize(
+    "base_effective_date, current_billing_date, expected_years",
+    [
+        # גבול ה-28 בפברואר בצד החיוב: היום עצמו כבר נספר
+        (datetime(2024, 5, 1), datetime(2025, 2, 27), 0),
+        (datetime(2024, 5, 1), datetime(2025, 2, 28), 1),
+        (datetime(2024, 5, 1), datetime(2025, 3, 1), 1),
+        # גבול ה-28 בפברואר בצד התוקף: תוקף ב-28 בפברואר אינו נספר באותה שנה
+        (datetime(2024, 2, 27), datetime(2024, 2, 28), 1),
+        (datetime(2024, 2, 28), datetime(2024, 2, 29), 0),
+        (datetime(2024, 2, 28), datetime(2025, 2, 28), 1),
+        # תאריך תוקף בפברואר (כפי שמוזן באפליקציה, ביום 1)
+        (datetime(2024, 2, 1), datetime(2024, 2, 28), 1),
+        (datetime(2024, 2, 1), datetime(2026, 3, 1), 3),
+        # חיוב בדצמבר ובינואר: מועד השנה הנוכחית עוד לא הגיע
+        (datetime(2023, 5, 1), datetime(2024, 12, 31), 1),
+        (datetime(2023, 5, 1), datetime(2025, 1, 1), 1),
+        (datetime(2023, 12, 1), datetime(2024, 1, 31), 0),
+        # חיוב לפני תאריך התוקף אינו מניב מספר שלילי
+        (datetime(2024, 5, 1), datetime(2023, 1, 1), 0),
+    ],
+)
+def test_boundary_cases(base_effective_date, current_billing_date, expected_years):
+    assert loop_linkage_years(base_effective_date, current_billing_date) == expected_years
+    assert closed_form_linkage_years(base_effective_date, current_billing_date) == expected_years
+
+
+def test_matches_loop_for_every_day():
+    # כל תאריכי התוקף (בכל יום בחודש) מול כל תאריכי החיוב, 2023-2026
+    days = [date(2023, 1, 1) + timedelta(days=offset) for offset in range((date(2027, 1, 1) - date(2023, 1, 1)).days)]
+    for base_day in days[::7] + [date(2024, 2, 28), date(2024, 2, 29), date(2025, 2, 28)]:
+        base_effective_date = datetime(base_day.year, base_day.month, base_day.day)
+        for billing_day in days:
+            current_billing_date = datetime(billing_day.year, billing_day.month, billing_day.day)
+            assert closed_form_linkage_years(base_effective_date, current_billing_date) == loop_linkage_years(
+                base_effective_date, current_billing_date
+            ), (base_effective_date, current_billing_date)
+
+
+def test_vectorized_matches_scalar():
+    base_effective_date = datetime(2022, 2, 1)
+    billing_dates = [datetime(2022, 1, 31), datetime(2022, 2, 28), datetime(2023, 12, 31), datetime(2024, 2, 29), datetime(2026, 1, 1)]
+    years = count_linkage_years(
+        base_effective_date,
+        np.array([d.year for d in billing_dates]),
+        np.array([d.month for d in billing_dates]),
+        np.array([d.day for d in billing_dates]),
+    )
+    assert years.tolist() == [loop_linkage_years(base_effective_date, d) for d in billing_dates]
+
+
+def test_multiplier_compounds_per_year():
+    assert get_annual_linkage_multiplier(datetime(2022, 5, 1), datetime(2025, 3, 1)) == pytest.approx(ANNUAL_LINKAGE_FACTOR ** 3)